@@ -11,7 +11,24 @@ import os
 import subprocess
 import threading
 from datetime import datetime
-from iso_builder import sanitize_filename
+from iso_builder import sanitize_filename, encode_json
+
+# Delay before refreshing the preview after an edit, so bursts of
+# keystrokes are coalesced into a single update
+PREVIEW_DELAY_MS = 150
+
+# Core packages for each desktop manager offered in the GUI
+DESKTOP_PACKAGES = {
+    "KDE Plasma": ("kde-plasma-desktop", "sddm"),
+    "GNOME": ("gnome-core", "gdm3"),
+    "XFCE": ("xfce4", "xfce4-goodies", "lightdm"),
+    "LXDE": ("lxde", "lightdm"),
+    "Cinnamon": ("cinnamon-desktop-environment", "lightdm"),
+    "MATE": ("mate-desktop-environment", "lightdm"),
+    "Budgie": ("budgie-desktop", "lightdm"),
+    "i3": ("i3", "lightdm"),
+    "None (Server/Minimal)": ()
+}
 
 
 class DebspinGUI:
@@ -114,6 +131,8 @@ git
 vim
 htop"""
         self.packages_text.insert("1.0", default_packages)
+        self.packages_text.edit_modified(False)
+        self._packages_cache = None
         
         # Configuration output section
         config_frame = ttk.LabelFrame(main_container, text="Configuration Preview", 
@@ -165,15 +184,27 @@ htop"""
                                            length=500)
         self.progress_bar.grid(row=1, column=0, sticky=(tk.W, tk.E))
         
+        # Refresh the preview as the user edits, debounced
+        self._preview_after_id = None
+        self._last_preview_key = None
+        self._last_preview_json = ""
+        for var in (self.os_name_var, self.version_var, self.desktop_var):
+            var.trace_add('write', self._schedule_preview)
+        self.packages_text.bind('<<Modified>>', self._on_packages_modified)
+        
         # Auto-preview on startup
         self.preview_config()
     
     def get_packages_list(self):
         """Get the list of packages from the text area"""
-        packages_content = self.packages_text.get("1.0", tk.END)
-        packages = [pkg.strip() for pkg in packages_content.split('\n') 
-                   if pkg.strip()]
-        return packages
+        # Only re-parse the text area after it has been edited
+        if self._packages_cache is None or self.packages_text.edit_modified():
+            packages_content = self.packages_text.get("1.0", "end-1c")
+            self._packages_cache = [
+                pkg for pkg in (line.strip() for line in packages_content.splitlines())
+                if pkg
+            ]
+        return list(self._packages_cache)
     
     def generate_config(self):
         """Generate the spinoff configuration"""
@@ -187,14 +218,50 @@ htop"""
         }
         return config
     
-    def preview_config(self):
+    def _schedule_preview(self, *args):
+        """Schedule a preview refresh, replacing any pending one"""
+        if self._preview_after_id:
+            self.root.after_cancel(self._preview_after_id)
+        self._preview_after_id = self.root.after(PREVIEW_DELAY_MS,
+                                                 self.preview_config, False)
+    
+    def _on_packages_modified(self, event):
+        """Handle edits to the package list"""
+        if not self.packages_text.edit_modified():
+            return
+        # Reset the flag so Tk fires <<Modified>> again on the next edit
+        self.packages_text.edit_modified(False)
+        self._packages_cache = None
+        self._schedule_preview()
+    
+    def preview_config(self, force=True):
         """Preview the configuration in JSON format"""
+        self._preview_after_id = None
         config = self.generate_config()
-        config_json = json.dumps(config, indent=2)
+        
+        # Unless forced (the button), skip the redraw if nothing but the
+        # timestamp has changed
+        preview_key = {k: v for k, v in config.items() if k != "created_at"}
+        if preview_key == self._last_preview_key and not force:
+            return
+        self._last_preview_key = preview_key
+        
+        config_json = encode_json(config).decode('utf-8')
+        if config_json == self._last_preview_json:
+            return
+        
+        # Only replace the text after the first changed character
+        # (commonprefix compares strings character by character)
+        prefix = os.path.commonprefix([self._last_preview_json, config_json])
+        # Tk 8.6 counts characters outside the BMP as two, so an index past
+        # one would be off; redraw everything instead
+        unchanged = 0 if max(prefix, default='') > '\uffff' else len(prefix)
+        start = f"1.0 + {unchanged} chars"
+        self._last_preview_json = config_json
         
         self.config_text.config(state=tk.NORMAL)
-        self.config_text.delete("1.0", tk.END)
-        self.config_text.insert("1.0", config_json)
+        self.config_text.delete(start, tk.END)
+        self.config_text.insert(start, config_json[unchanged:])
         self.config_text.config(state=tk.DISABLED)
     
     def update_progress(self, percentage, message):
@@ -205,18 +272,7 @@ htop"""
     
     def get_desktop_packages(self, desktop_manager):
         """Map desktop manager to required packages"""
-        desktop_packages = {
-            "KDE Plasma": ["kde-plasma-desktop", "sddm"],
-            "GNOME": ["gnome-core", "gdm3"],
-            "XFCE": ["xfce4", "xfce4-goodies", "lightdm"],
-            "LXDE": ["lxde", "lightdm"],
-            "Cinnamon": ["cinnamon-desktop-environment", "lightdm"],
-            "MATE": ["mate-desktop-environment", "lightdm"],
-            "Budgie": ["budgie-desktop", "lightdm"],
-            "i3": ["i3", "lightdm"],
-            "None (Server/Minimal)": []
-        }
-        return desktop_packages.get(desktop_manager, [])
+        return DESKTOP_PACKAGES.get(desktop_manager, ())
     
     def build_iso(self):
         """Build the Debian ISO"""
@@ -8,11 +8,298 @@ import os
 import subprocess
 import tempfile
 import shutil
-import json
 import re
+import functools
+import collections
+import concurrent.futures
+import threading
+import socket
+import uuid
+import errno
+import hashlib
+import time
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+try:
+    import pycdlib
+except ImportError:
+    pycdlib = None
+
+# Set DEBSPIN_DEBUG=1 to print the external commands being run
+DEBUG = os.environ.get('DEBSPIN_DEBUG') == '1'
+
+# Joliet names are limited to 64 characters unless -joliet-long is given
+JOLIET_MAX_NAME = 64
+# pycdlib stores the Joliet volume ID as UTF-16 in 32 bytes
+JOLIET_MAX_VOLUME_ID = 16
+# ISO levels 1 and 2 cannot store files of 4 GiB or more
+ISO_LEVEL2_MAX_FILE = 4 * 1024 * 1024 * 1024 - 1
+
+# Write buffer for the Python tarfile fallback
+TAR_BUFFER_SIZE = 1024 * 1024
+# Chunk size for userspace file copies when sendfile cannot be used
+COPY_BUFSIZE = 256 * 1024
+
+# Trailing lines of a tool's stderr kept for error reports
+STDERR_TAIL_LINES = 100
+
+# Free space wanted in the work directory for a live build
+WORK_DIR_MIN_FREE = 8 * 1024 * 1024 * 1024
+# Filesystems that can hold a rootfs (symlinks, device nodes, ownership).
+# The output folder is only used for the work dir if it is one of these,
+# so a vfat, exFAT or NTFS USB stick is never picked.
+POSIX_FILESYSTEMS = frozenset({
+    'ext2', 'ext3', 'ext4', 'xfs', 'btrfs', 'f2fs', 'jfs', 'reiserfs',
+    'zfs', 'bcachefs', 'tmpfs', 'overlay',
+})
+
+# Rough size of a desktop rootfs. The work dir is put on a tmpfs of twice
+# this size when the machine has that much memory available.
+ROOTFS_SIZE_ESTIMATE = 6 * 1024 * 1024 * 1024
+
+# Where distributions install the BIOS boot loader files, in lookup order
+ISOLINUX_BIN_PATHS = (
+    '/usr/lib/ISOLINUX/isolinux.bin',
+    '/usr/share/syslinux/isolinux.bin',
+    '/usr/lib/syslinux/isolinux.bin',
+)
+LDLINUX_C32_PATHS = (
+    '/usr/lib/syslinux/modules/bios/ldlinux.c32',
+    '/usr/share/syslinux/ldlinux.c32',
+    '/usr/lib/ISOLINUX/ldlinux.c32',
+)
+
+# Debian release and mirror the live system is built from
+DEBIAN_SUITE = 'bookworm'
+DEFAULT_MIRROR = 'http://deb.debian.org/debian'
+DEBOOTSTRAP_VARIANT = 'minbase'
+DEBOOTSTRAP_INCLUDES = ('apt', 'eatmydata', 'locales', 'sudo', 'systemd-sysv',
+                        'live-boot', 'linux-image-amd64')
+# Cached base systems older than this are bootstrapped afresh
+BASE_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+# Cache location for root. Live builds run as root and unpack the base
+# cache into the ISO, so it must not live in a user-writable home.
+SYSTEM_CACHE_DIR = '/var/cache/debspin'
+# Local package sources preferred over DEFAULT_MIRROR when present
+APT_CACHER_ADDRESS = ('127.0.0.1', 3142)
+LOCAL_MIRROR_DIR = '/var/cache/apt-mirror/mirror/deb.debian.org/debian'
+
+# Refresh package lists and install the packages given as arguments in one
+# chroot call, under eatmydata when the chroot has it
+APT_INSTALL_SCRIPT = ('apt-get update && exec $(command -v eatmydata) '
+                      'apt-get install -y --no-install-recommends "$@"')
+
+# dpkg/apt settings that only apply while the image is being built. They
+# skip per-file fsync and recommends, and are removed before packaging.
+BUILD_ONLY_CONFIG = (
+    ('etc/dpkg/dpkg.cfg.d/01-debspin-unsafe-io', b'force-unsafe-io\n'),
+    ('etc/apt/apt.conf.d/01-debspin', b'APT::Install-Recommends "false";\n'),
+)
+
+# Patterns and tables used by the sanitize_* helpers
+_FN_NONALNUM_RE = re.compile(r'[^a-zA-Z0-9._-]')
+_GRUB_CTRL_RE = re.compile(r'[\x00-\x1f\x7f]')
+_ISO9660_BAD_RE = re.compile(r'[^A-Z0-9_.]')
+_PKG_BAD_RE = re.compile(r'[^a-z0-9+.\-]')
+_GRUB_ESCAPE_TABLE = str.maketrans({'\\': '\\\\', '"': '\\"'})
+_GRUB_UNSAFE_CHARS = frozenset('\\"\x7f' + ''.join(map(chr, range(0x20))))
+
+
+def _make_filename_table():
+    """
+    Build the ASCII translation table used by sanitize_filename
+    
+    Spaces become underscores, filesystem-unsafe characters are dropped and
+    anything else outside [a-zA-Z0-9._-] becomes a dash.
+    """
+    table = {}
+    for code in range(128):
+        char = chr(code)
+        if char == ' ':
+            table[code] = '_'
+        elif char in '/\\:*?"<>|':
+            table[code] = None
+        elif not (char.isalnum() or char in '._-'):
+            table[code] = '-'
+    return table
+
+
+_FN_TABLE = _make_filename_table()
+
+
+# Packages installed for each supported desktop manager
+DESKTOP_PACKAGES = {
+    "KDE Plasma": (
+        "kde-plasma-desktop",
+        "sddm",
+        "plasma-nm",
+        "plasma-pa"
+    ),
+    "GNOME": (
+        "gnome-core",
+        "gdm3",
+        "gnome-terminal",
+        "nautilus"
+    ),
+    "XFCE": (
+        "xfce4",
+        "xfce4-goodies",
+        "lightdm",
+        "xfce4-terminal"
+    ),
+    "LXDE": (
+        "lxde",
+        "lightdm",
+        "lxterminal"
+    ),
+    "Cinnamon": (
+        "cinnamon-desktop-environment",
+        "lightdm",
+        "gnome-terminal"
+    ),
+    "MATE": (
+        "mate-desktop-environment",
+        "lightdm",
+        "mate-terminal"
+    ),
+    "Budgie": (
+        "budgie-desktop",
+        "lightdm",
+        "gnome-terminal"
+    ),
+    "i3": (
+        "i3",
+        "lightdm",
+        "i3status",
+        "dmenu",
+        "xterm"
+    ),
+    "None (Server/Minimal)": ()
+}
+
+
+# Text templates for the demonstration (stub) ISO
+_README_TEMPLATE = """
+{os_name} - Custom Debian Spinoff
+Version: {version_code}
+
+This ISO contains a custom Debian distribution with:
+- Desktop Manager: {desktop_manager}
+- Custom packages: {package_count} packages included
+
+Features:
+✓ Live Boot capability
+✓ Installation capability
+✓ Custom package selection
+✓ User-configured desktop environment
+
+To use this ISO:
+1. Write it to a USB drive using tools like:
+   - Rufus (Windows)
+   - Etcher (Cross-platform)
+   - dd command (Linux/Mac)
+
+2. Boot from the USB drive
+
+3. Choose between:
+   - Try the live environment
+   - Install to your computer
+
+Created with Debspin - Debian Spinoff Creator
+"""
+
+_STUB_GRUB_TEMPLATE = """
+# GRUB Configuration for {os_name}
+set default=0
+set timeout=10
+
+menuentry "{os_name} {version} - Live" {{
+    linux /boot/vmlinuz boot=live
+    initrd /boot/initrd.img
+}}
+
+menuentry "{os_name} {version} - Install" {{
+    linux /boot/vmlinuz
+    initrd /boot/initrd.img
+}}
+"""
+
+_FALLBACK_INFO_TEMPLATE = """Debspin ISO Builder Output
+
+The requested ISO file could not be created because required tools
+(debootstrap, xorriso, squashfs-tools) are not installed.
+
+Instead, a tar.gz archive has been created at:
+{tar_path}
+
+This archive contains all the metadata and configuration that would
+be in the ISO:
+- Boot configuration (GRUB)
+- Package lists (desktop environment + user packages)
+- ISO metadata (JSON format)
+- README with usage instructions
+
+To create a real bootable ISO, install the required tools:
+  Ubuntu/Debian: sudo apt-get install debootstrap xorriso squashfs-tools
+  Fedora: sudo dnf install debootstrap xorriso squashfs-tools
+  Arch: sudo pacman -S debootstrap libisoburn squashfs-tools
+
+Then run Debspin again to build the ISO.
+
+Archive location: {tar_path}
+ISO metadata: See debspin_metadata.json in the archive
+"""
+
+# Boot menu entries for the live ISO, shared by the GRUB and isolinux
+# menus: (isolinux label, GRUB title, isolinux title, kernel arguments)
+LIVE_BOOT_ENTRIES = (
+    ("live", "Live (Try without installing)", "Live", "boot=live quiet splash"),
+    ("livesafe", "Live (Safe graphics)", "Live (Safe graphics)", "boot=live nomodeset quiet"),
+    ("install", "Install", "Install", "boot=live quiet"),
+)
+
+_LIVE_GRUB_HEADER = """# GRUB Configuration for {os_name}
+set default=0
+set timeout=10
+
+insmod all_video
+insmod gfxterm
+
+"""
+
+_GRUB_MENUENTRY = """menuentry "{os_name} {version} - {title}" {{
+    linux /boot/vmlinuz {args}
+    initrd /boot/initrd.img
+}}
+
+"""
+
+_LIVE_GRUB_FOOTER = b"""menuentry "Boot from first hard disk" {
+    set root=(hd0)
+    chainloader +1
+}
+"""
+
+_ISOLINUX_HEADER = """# ISOLINUX Configuration for {os_name}
+DEFAULT live
+TIMEOUT 100
+PROMPT 1
+
+"""
+
+_ISOLINUX_LABEL = """LABEL {label}
+    MENU LABEL {os_name} {version} - {title}
+    KERNEL /boot/vmlinuz
+    APPEND initrd=/boot/initrd.img {args}
+"""
+
+
+@functools.lru_cache(maxsize=256)
 def sanitize_filename(text):
     """
     Sanitize a string to make it safe for use in filenames
@@ -23,17 +310,18 @@ def sanitize_filename(text):
     Returns:
         A sanitized version safe for filenames
     """
-    # Replace spaces with underscores
-    text = text.replace(' ', '_')
-    # Remove characters that are problematic for filesystems
-    text = re.sub(r'[/\\:*?"<>|]', '', text)
-    # Replace any remaining non-alphanumeric characters (except dots, dashes, underscores)
-    text = re.sub(r'[^a-zA-Z0-9._-]', '-', text)
+    # Replace spaces, drop filesystem-unsafe characters and dash out any
+    # other ASCII punctuation in a single pass
+    text = text.translate(_FN_TABLE)
+    # Non-ASCII characters are not in the table; dash them out too
+    if not text.isascii():
+        text = _FN_NONALNUM_RE.sub('-', text)
     # Remove leading/trailing dots and dashes
     text = text.strip('.-')
     return text
 
 
+@functools.lru_cache(maxsize=256)
 def sanitize_grub_string(text):
     """
     Sanitize a string for safe use in GRUB configuration
@@ -44,17 +332,439 @@ def sanitize_grub_string(text):
     Returns:
         A sanitized version safe for GRUB config
     """
+    # Most names need no escaping at all
+    if _GRUB_UNSAFE_CHARS.isdisjoint(text):
+        return text
     # Escape quotes and backslashes
-    text = text.replace('\\', '\\\\')
-    text = text.replace('"', '\\"')
+    text = text.translate(_GRUB_ESCAPE_TABLE)
     # Remove control characters
-    text = re.sub(r'[\x00-\x1f\x7f]', '', text)
+    text = _GRUB_CTRL_RE.sub('', text)
     return text
 
 
+@functools.lru_cache(maxsize=None)
+def _find_tool(name):
+    """Look up an executable on PATH, caching the result for the process"""
+    return shutil.which(name)
+
+
+@functools.lru_cache(maxsize=None)
+def _find_first_existing(paths):
+    """Return the first of a tuple of paths that is a file, or None"""
+    return next((path for path in paths if os.path.isfile(path)), None)
+
+
+@functools.lru_cache(maxsize=None)
+def _mksquashfs_help():
+    """
+    Return mksquashfs' full help text, read once per process
+    
+    squashfs-tools 4.6 and later print only a section summary for -help and
+    list the options under -help-all, which older versions reject. Returns
+    '' if mksquashfs is unavailable.
+    """
+    for flag in ('-help-all', '-help'):
+        try:
+            result = subprocess.run(['mksquashfs', flag], capture_output=True,
+                                    text=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            return ''
+        if flag == '-help' or result.returncode == 0:
+            return result.stdout + result.stderr
+
+
+def _mksquashfs_has_compressor(name):
+    """Check whether mksquashfs was built with a compressor"""
+    # The compressor list is printed as indented names, one per line
+    return re.search(rf'^\s+{re.escape(name)}\b', _mksquashfs_help(),
+                     re.MULTILINE) is not None
+
+
+def _mksquashfs_has_option(option):
+    """Check whether mksquashfs accepts an option, e.g. '-percentage'"""
+    return re.search(rf'^\s*{re.escape(option)}\b', _mksquashfs_help(),
+                     re.MULTILINE) is not None
+
+
+def _cache_dir(*parts):
+    """Return a directory under the Debspin cache, creating it if needed"""
+    if os.geteuid() == 0:
+        # Under sudo -E, XDG_CACHE_HOME and ~ still name the invoking user's
+        path = os.path.join(SYSTEM_CACHE_DIR, *parts)
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        path = os.path.join(base, 'debspin', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _fs_type(path):
+    """Return the type of the filesystem holding path, or None if unknown"""
+    path = os.path.realpath(path)
+    best, fs_type = '', None
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                fields, _, rest = line.partition(' - ')
+                # Spaces and the like are octal-escaped in mount points
+                mount_point = re.sub(r'\\([0-7]{3})',
+                                     lambda m: chr(int(m.group(1), 8)),
+                                     fields.split()[4])
+                inside = (path == mount_point
+                          or path.startswith(mount_point.rstrip('/') + '/'))
+                # Later lines win, as they are mounted over earlier ones
+                if inside and len(mount_point) >= len(best):
+                    best, fs_type = mount_point, rest.split()[0]
+    except (OSError, IndexError):
+        return None
+    return fs_type
+
+
+def _owned_by_root(path):
+    """Check that path is owned by root and not group- or world-writable"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_uid == 0 and not st.st_mode & 0o022
+
+
+def _mem_available():
+    """Return MemAvailable from /proc/meminfo in bytes, or 0 if unknown"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+def _remove_entry(path):
+    """Delete a file or directory tree, ignoring errors"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _remove_entries(paths):
+    """Delete each of paths with _remove_entry"""
+    for path in paths:
+        _remove_entry(path)
+
+
+def _fast_rmtree(path):
+    """
+    Delete a large directory tree using a pool of threads
+    
+    The tree is split two levels down, so a work dir holding a single rootfs
+    still fans out over the rootfs' top-level directories. Whatever the
+    workers could not remove is left for the final shutil.rmtree, which
+    raises as usual.
+    
+    Plain threads are used rather than a ThreadPoolExecutor, since this
+    runs from the cleanup thread while the interpreter is exiting, when an
+    executor can no longer be created.
+    """
+    entries = []
+    with os.scandir(path) as top:
+        for entry in top:
+            if entry.is_dir(follow_symlinks=False):
+                with os.scandir(entry.path) as sub:
+                    entries.extend(child.path for child in sub)
+    
+    workers = min(os.cpu_count() or 1, len(entries))
+    threads = []
+    for i in range(workers):
+        worker = threading.Thread(
+            target=_remove_entries,
+            args=(entries[i::workers],)
+        )
+        try:
+            worker.start()
+        except RuntimeError:
+            # No more threads can be started; the rmtree below does the rest
+            break
+        threads.append(worker)
+    for worker in threads:
+        worker.join()
+    shutil.rmtree(path)
+
+
+def _remove_tree(path):
+    """Delete a directory tree, reporting rather than raising on failure"""
+    try:
+        _fast_rmtree(path)
+    except Exception as e:
+        print(f"\n⚠ Warning: Could not clean up {path}: {e}")
+
+
+def _run_command(cmd, timeout=None, tail_lines=STDERR_TAIL_LINES, env=None,
+                 on_line=None):
+    """
+    Run a command, keeping only the last lines of its stderr
+    
+    stderr is drained by a background thread into a bounded buffer, so
+    memory use does not grow with the command's output. stdout is discarded
+    unless on_line is given, in which case a second thread hands each
+    stdout line to it as it arrives.
+    
+    Args:
+        cmd: The command to run, as a list
+        timeout: Optional timeout in seconds
+        tail_lines: How many trailing stderr lines to keep
+        env: Optional environment for the command
+        on_line: Optional callable taking one line of stdout
+        
+    Returns:
+        tuple: (return code, the retained stderr lines as one string)
+        
+    Raises:
+        subprocess.TimeoutExpired: If the command runs past the timeout
+    """
+    tail = collections.deque(maxlen=tail_lines)
+    stdout = subprocess.DEVNULL if on_line is None else subprocess.PIPE
+    proc = subprocess.Popen(cmd, stdout=stdout,
+                            stderr=subprocess.PIPE, text=True, errors='replace',
+                            env=env)
+    
+    def drain():
+        for line in proc.stderr:
+            tail.append(line)
+    
+    def follow():
+        for line in proc.stdout:
+            on_line(line)
+    
+    readers = [threading.Thread(target=drain, daemon=True)]
+    if on_line is not None:
+        readers.append(threading.Thread(target=follow, daemon=True))
+    for reader in readers:
+        reader.start()
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        # Children of the command may still hold the pipes open
+        for reader in readers:
+            reader.join(timeout=5)
+        raise
+    for reader in readers:
+        reader.join()
+    proc.stderr.close()
+    if proc.stdout is not None:
+        proc.stdout.close()
+    return proc.returncode, ''.join(tail)
+
+
+def _du_size(path):
+    """Apparent size in bytes of the tree under path from one du call, or 0"""
+    try:
+        result = subprocess.run(['du', '-s', '--apparent-size', '-B1', path],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                text=True, timeout=300)
+        return int(result.stdout.split()[0])
+    except (OSError, subprocess.TimeoutExpired, ValueError, IndexError):
+        return 0
+
+
+def _read_tail(path, size):
+    """Return the last size bytes of a log file, decoded as UTF-8"""
+    with open(path, 'rb') as f:
+        f.seek(max(0, os.fstat(f.fileno()).st_size - size))
+        return f.read().decode('utf-8', errors='replace')
+
+
+def _iso9660_name(name, is_dir):
+    """
+    Map a file or directory name onto ISO9660 level 3 d-characters
+    
+    The original name is still recorded through Rock Ridge and Joliet;
+    this is only the plain ISO9660 identifier.
+    """
+    name = _ISO9660_BAD_RE.sub('_', name.upper())
+    if is_dir:
+        return name.replace('.', '_')[:31] or '_'
+    stem, dot, ext = name.rpartition('.')
+    if not dot:
+        stem, ext = ext, ''
+    stem = stem.replace('.', '_')[:30 - min(len(ext), 3) - 1] or '_'
+    return f"{stem}.{ext[:3]}"
+
+
+def _unique_iso9660_name(name, is_dir, used):
+    """Return an ISO9660 name for name that is not already in used"""
+    iso_name = _iso9660_name(name, is_dir)
+    candidate = iso_name
+    counter = 1
+    while candidate in used:
+        counter += 1
+        suffix = f"_{counter}"
+        if is_dir:
+            candidate = iso_name[:31 - len(suffix)] + suffix
+        else:
+            stem, _, ext = iso_name.rpartition('.')
+            candidate = f"{stem[:26 - len(suffix)]}{suffix}.{ext}"
+    used.add(candidate)
+    return candidate
+
+
+def _print_trace():
+    """Print the traceback of the exception being handled"""
+    # Only needed on failure, so keep it off the import path
+    import traceback
+    traceback.print_exc()
+
+
+def _write_file(path, data, mode=0o644):
+    """
+    Write bytes to a file with a plain open/write/close
+    
+    Skips the buffered and text file object layers, which only add
+    overhead for small generated files written in one piece. A list of
+    byte strings is written with a single os.writev.
+    
+    Args:
+        path: The file to create or truncate
+        data: The bytes to write, or a list of bytes chunks
+        mode: Permission bits used when the file is created
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        if isinstance(data, list):
+            written = os.writev(fd, data)
+            # Short writes are rare for regular files; only then join the
+            # chunks to finish the remainder
+            data = b''.join(data)[written:] if written < sum(map(len, data)) else b''
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def _zero_copy(src, dst):
+    """
+    Copy a file's contents with os.sendfile, keeping the data in the kernel
+    
+    Falls back to a userspace copy where sendfile is not supported between
+    the two files.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        in_fd, out_fd = fsrc.fileno(), fdst.fileno()
+        remaining = os.fstat(in_fd).st_size
+        offset = 0
+        try:
+            while remaining > 0:
+                sent = os.sendfile(out_fd, in_fd, offset, remaining)
+                if sent == 0:
+                    break
+                offset += sent
+                remaining -= sent
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP) or offset:
+                raise
+            shutil.copyfileobj(fsrc, fdst, length=COPY_BUFSIZE)
+
+
+def _link_or_copy(src, dst):
+    """
+    Hard link src to dst, copying instead when a link is not possible
+    
+    Used for large files staged within the work dir, which only need to
+    appear in the ISO tree and are never modified there. A symlinked src
+    is resolved first, and dst is replaced if it already exists.
+    """
+    try:
+        os.unlink(dst)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(os.path.realpath(src), dst)
+    except OSError as e:
+        # Different filesystems, or one that does not allow the link
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        _zero_copy(src, dst)
+
+
+def _drop_page_cache(path):
+    """
+    Ask the kernel to drop cached pages of a finished output file
+    
+    Best effort: pages not yet written back stay cached, and platforms
+    without posix_fadvise are skipped.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except (AttributeError, OSError):
+        pass
+
+
+class _CountingWriter:
+    """Binary file wrapper that counts the bytes written through it"""
+    __slots__ = ('fileobj', 'count')
+    
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+    
+    def write(self, data):
+        self.count += len(data)
+        return self.fileobj.write(data)
+    
+    def flush(self):
+        self.fileobj.flush()
+
+
+def encode_json(obj, compact=False):
+    """
+    Serialize an object to UTF-8 encoded JSON
+    
+    Uses orjson when it is installed and falls back to the standard
+    library json module otherwise. Both produce the same layout.
+    
+    Args:
+        obj: The object to serialize
+        compact: Leave out all optional whitespace instead of indenting
+        
+    Returns:
+        The JSON document as bytes
+    """
+    if orjson is not None:
+        if compact:
+            return orjson.dumps(obj)
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    import json
+    if compact:
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+
 class ISOBuilder:
     """Builds a custom Debian ISO with live boot and installation capabilities"""
     
+    __slots__ = (
+        'config',
+        'output_path',
+        'work_dir',
+        'progress_callback',
+        '_xorriso',
+        '_genisoimage',
+        '_pigz',
+        '_tmpfs_mounted',
+    )
+    
     def __init__(self, config, output_path, progress_callback=None):
         """
         Initialize the ISO builder
@@ -71,6 +781,12 @@ class ISOBuilder:
         self.work_dir = None
         self.progress_callback = progress_callback
         
+        # Resolve optional tools once rather than walking PATH per use
+        self._xorriso = _find_tool('xorriso')
+        self._genisoimage = _find_tool('genisoimage')
+        self._pigz = _find_tool('pigz')
+        self._tmpfs_mounted = False
+        
     def _report_progress(self, percentage, message):
         """Report progress to the callback if available"""
         if self.progress_callback:
@@ -92,34 +808,125 @@ class ISOBuilder:
             print(f"Output: {self.output_path}")
             print(f"{'='*60}\n")
             
-            # Create temporary working directory
-            self._report_progress(5, "Creating temporary working directory...")
-            self.work_dir = tempfile.mkdtemp(prefix='debspin_build_')
-            print(f"Working directory: {self.work_dir}")
-            
             # Check for required tools
-            self._report_progress(10, "Checking system requirements...")
-            if not self._check_requirements():
-                print("\n⚠ WARNING: Required tools not found!")
-                print("Creating a minimal ISO stub for demonstration purposes.")
-                return self._create_stub_iso()
+            self._report_progress(5, "Checking system requirements...")
+            live_build = self._check_requirements()
             
-            # Build the ISO using live-build
-            return self._build_with_live_build()
+            # Create temporary working directory. A stub build stays in the
+            # system temp dir rather than next to the user's file.
+            self._report_progress(10, "Creating temporary working directory...")
+            with tempfile.TemporaryDirectory(prefix='debspin_build_',
+                                             dir=self._pick_workdir() if live_build else None,
+                                             ignore_cleanup_errors=True) as self.work_dir:
+                try:
+                    return self._build_in_work_dir(live_build)
+                finally:
+                    self._unmount_tmpfs()
+                    # Hand the tree to a background thread; once renamed,
+                    # the context manager is left with nothing to delete
+                    self._discard_work_dir()
             
         except Exception as e:
             print(f"\n❌ Error building ISO: {e}")
-            import traceback
-            traceback.print_exc()
+            _print_trace()
             return False
         finally:
-            # Clean up working directory
-            if self.work_dir and os.path.exists(self.work_dir):
-                try:
-                    shutil.rmtree(self.work_dir)
-                    print(f"\n✓ Cleaned up working directory")
-                except Exception as e:
-                    print(f"\n⚠ Warning: Could not clean up {self.work_dir}: {e}")
+            self.work_dir = None
+    
+    def _pick_workdir(self):
+        """
+        Choose where to create the working directory
+        
+        Building next to the output keeps mksquashfs input and the final ISO
+        on one filesystem, but only if that filesystem can hold a rootfs.
+        /var/tmp is tried next since /tmp is often a small tmpfs. None means
+        the system default temporary directory.
+        """
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        candidates = (output_dir, '/var/tmp')
+        for candidate in candidates:
+            try:
+                st = os.statvfs(candidate)
+            except OSError:
+                continue
+            if (st.f_bavail * st.f_frsize >= WORK_DIR_MIN_FREE
+                    and os.access(candidate, os.W_OK)
+                    and _fs_type(candidate) in POSIX_FILESYSTEMS):
+                return candidate
+        return None
+    
+    def _build_in_work_dir(self, live_build):
+        """Run the build inside the freshly created working directory"""
+        print(f"Working directory: {self.work_dir}")
+        
+        if not live_build:
+            print("\n⚠ WARNING: Required tools not found!")
+            print("Creating a minimal ISO stub for demonstration purposes.")
+            return self._create_stub_iso()
+        
+        # Build the ISO using live-build
+        self._mount_tmpfs()
+        return self._build_with_live_build()
+    
+    def _mount_tmpfs(self):
+        """
+        Put the working directory on a tmpfs when memory allows
+        
+        Controlled by config['use_tmpfs']: 'auto' (the default) mounts only
+        when MemAvailable is at least twice ROOTFS_SIZE_ESTIMATE, True always
+        tries and False never does.
+        """
+        use_tmpfs = self.config.get('use_tmpfs', 'auto')
+        if not use_tmpfs:
+            return
+        tmpfs_size = 2 * ROOTFS_SIZE_ESTIMATE
+        if use_tmpfs == 'auto' and _mem_available() < tmpfs_size:
+            return
+        
+        result = subprocess.run(
+            ['mount', '-t', 'tmpfs', '-o', f'size={tmpfs_size},mode=0755',
+             'tmpfs', self.work_dir],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        if result.returncode == 0:
+            self._tmpfs_mounted = True
+            print(f"✓ Working directory is on a {tmpfs_size // 1024**3} GB tmpfs")
+        else:
+            print(f"⚠ Could not mount tmpfs, building on disk: {result.stderr.strip()}")
+    
+    def _unmount_tmpfs(self):
+        """Unmount the working directory tmpfs, if one was mounted"""
+        if not self._tmpfs_mounted:
+            return
+        # A lazy unmount cannot fail on a busy mount; the memory is freed
+        # once the last user is gone
+        subprocess.run(['umount', '-l', self.work_dir],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._tmpfs_mounted = False
+    
+    def _discard_work_dir(self):
+        """
+        Remove the working directory without making the caller wait
+        
+        The directory is first renamed aside, which is instant, and then
+        deleted by a background thread. The thread is not a daemon, so the
+        interpreter still waits for it before exiting. If the rename fails,
+        the enclosing TemporaryDirectory deletes the tree itself.
+        """
+        trash_dir = f"{self.work_dir}.trash-{uuid.uuid4().hex[:8]}"
+        try:
+            os.rename(self.work_dir, trash_dir)
+        except OSError:
+            # Deleting in place from a thread would race the context
+            # manager's own cleanup of the same tree
+            return
+        
+        threading.Thread(
+            target=_remove_tree,
+            args=(trash_dir,),
+            name='debspin-cleanup'
+        ).start()
+        print(f"\n✓ Cleaning up working directory in the background")
     
     def _check_requirements(self):
         """Check if required tools are available and user has proper permissions"""
@@ -127,7 +934,7 @@ class ISOBuilder:
         missing_tools = []
         
         for tool in required_tools:
-            if shutil.which(tool) is None:
+            if _find_tool(tool) is None:
                 missing_tools.append(tool)
         
         if missing_tools:
@@ -181,41 +988,18 @@ class ISOBuilder:
             }
             
             metadata_path = os.path.join(iso_dir, 'debspin_metadata.json')
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            _write_file(metadata_path, encode_json(metadata))
             
             self._report_progress(50, "Creating README file...")
             # Create a README
             readme_path = os.path.join(iso_dir, 'README.txt')
-            with open(readme_path, 'w') as f:
-                f.write(f"""
-{self.config['os_name']} - Custom Debian Spinoff
-Version: {self.config['version_code']}
-
-This ISO contains a custom Debian distribution with:
-- Desktop Manager: {self.config['desktop_manager']}
-- Custom packages: {len(self.config['packages'])} packages included
-
-Features:
-✓ Live Boot capability
-✓ Installation capability
-✓ Custom package selection
-✓ User-configured desktop environment
-
-To use this ISO:
-1. Write it to a USB drive using tools like:
-   - Rufus (Windows)
-   - Etcher (Cross-platform)
-   - dd command (Linux/Mac)
-
-2. Boot from the USB drive
-
-3. Choose between:
-   - Try the live environment
-   - Install to your computer
-
-Created with Debspin - Debian Spinoff Creator
-""")
+            readme = _README_TEMPLATE.format(
+                os_name=self.config['os_name'],
+                version_code=self.config['version_code'],
+                desktop_manager=self.config['desktop_manager'],
+                package_count=len(self.config['packages'])
+            )
+            _write_file(readme_path, readme.encode('utf-8'))
             
             self._report_progress(65, "Creating boot configuration...")
             # Create boot configuration stub
@@ -223,43 +1007,30 @@ Created with Debspin - Debian Spinoff Creator
             os.makedirs(boot_dir, exist_ok=True)
             
             grub_cfg_path = os.path.join(boot_dir, 'grub.cfg')
-            with open(grub_cfg_path, 'w') as f:
-                # Sanitize values for GRUB configuration
-                os_name_safe = sanitize_grub_string(self.config['os_name'])
-                version_safe = sanitize_grub_string(self.config['version_code'])
-                
-                f.write(f"""
-# GRUB Configuration for {os_name_safe}
-set default=0
-set timeout=10
-
-menuentry "{os_name_safe} {version_safe} - Live" {{
-    linux /boot/vmlinuz boot=live
-    initrd /boot/initrd.img
-}}
-
-menuentry "{os_name_safe} {version_safe} - Install" {{
-    linux /boot/vmlinuz
-    initrd /boot/initrd.img
-}}
-""")
+            # Sanitize values for GRUB configuration
+            os_name_safe = sanitize_grub_string(self.config['os_name'])
+            version_safe = sanitize_grub_string(self.config['version_code'])
+            grub_cfg = _STUB_GRUB_TEMPLATE.format(os_name=os_name_safe,
+                                                  version=version_safe)
+            _write_file(grub_cfg_path, grub_cfg.encode('utf-8'))
             
             self._report_progress(75, "Creating package list...")
             # Create package list
             packages_path = os.path.join(iso_dir, 'packages.list')
-            with open(packages_path, 'w') as f:
-                f.write("# Desktop Environment Packages\n")
-                desktop_packages = self._get_desktop_packages()
-                for pkg in desktop_packages:
-                    f.write(f"{pkg}\n")
-                
-                f.write("\n# User-specified Packages\n")
-                for pkg in self.config['packages']:
-                    f.write(f"{pkg}\n")
+            desktop_packages = self._get_desktop_packages()
+            packages_content = (
+                "# Desktop Environment Packages\n"
+                + "".join(f"{pkg}\n" for pkg in desktop_packages)
+                + "\n# User-specified Packages\n"
+                + "".join(f"{pkg}\n" for pkg in self.config['packages'])
+            )
+            _write_file(packages_path, packages_content.encode('utf-8'))
             
             self._report_progress(85, "Creating ISO file...")
             # Create the ISO using xorriso if available, otherwise create a tar archive
-            if shutil.which('genisoimage') or shutil.which('xorriso'):
+            if pycdlib is not None:
+                return self._create_iso_with_pycdlib(iso_dir)
+            if self._genisoimage or self._xorriso:
                 return self._create_iso_with_xorriso(iso_dir)
             else:
                 # Fallback: create a tar.gz archive
@@ -267,60 +1038,119 @@ menuentry "{os_name_safe} {version_safe} - Install" {{
                 
         except Exception as e:
             print(f"❌ Error creating stub ISO: {e}")
-            import traceback
-            traceback.print_exc()
+            _print_trace()
             return False
     
+    def _create_iso_with_pycdlib(self, iso_dir):
+        """
+        Create the ISO in-process with pycdlib
+        
+        Avoids starting an external tool for the small stub tree. Falls back
+        to xorriso/genisoimage if pycdlib fails.
+        """
+        try:
+            print(f"\n📀 Creating ISO file (pycdlib)...")
+            iso = pycdlib.PyCdlib()
+            iso.new(interchange_level=3, joliet=3, rock_ridge='1.09',
+                    vol_ident=_iso9660_name(sanitize_filename(self.config['os_name']),
+                                            is_dir=True)[:JOLIET_MAX_VOLUME_ID])
+            try:
+                # Map each staged directory to its ISO9660 and Joliet paths
+                iso_paths = {iso_dir: ('', '')}
+                for dirpath, dirnames, filenames in os.walk(iso_dir):
+                    parent_iso, parent_joliet = iso_paths[dirpath]
+                    used = set()
+                    for name in sorted(dirnames):
+                        iso_name = _unique_iso9660_name(name, True, used)
+                        child = (f"{parent_iso}/{iso_name}", f"{parent_joliet}/{name}")
+                        iso.add_directory(child[0], rr_name=name, joliet_path=child[1])
+                        iso_paths[os.path.join(dirpath, name)] = child
+                    for name in sorted(filenames):
+                        iso_name = _unique_iso9660_name(name, False, used)
+                        iso.add_file(os.path.join(dirpath, name),
+                                     f"{parent_iso}/{iso_name};1",
+                                     rr_name=name,
+                                     joliet_path=f"{parent_joliet}/{name}")
+                iso.write(self.output_path)
+            finally:
+                iso.close()
+            
+            return self._report_iso_created()
+            
+        except Exception as e:
+            print(f"⚠ pycdlib could not create the ISO: {e}")
+            return self._create_iso_with_xorriso(iso_dir)
+    
+    def _report_iso_created(self):
+        """Report a successfully written stub ISO"""
+        print(f"\n✓ ISO created successfully: {self.output_path}")
+        file_size = os.stat(self.output_path).st_size / (1024 * 1024)
+        print(f"✓ Size: {file_size:.2f} MB")
+        self._report_progress(100, f"ISO created successfully ({file_size:.2f} MB)")
+        return True
+    
     def _create_iso_with_xorriso(self, iso_dir):
         """Create ISO using xorriso or genisoimage"""
         try:
+            # Only pay for long Joliet names and ISO level 3 when the
+            # tree actually needs them
+            longest_name, largest_file = self._scan_iso_tree(iso_dir)
+            iso_opts = ['-r', '-J']
+            if longest_name > JOLIET_MAX_NAME:
+                iso_opts.append('-joliet-long')
+            iso_opts.extend([
+                '-l',
+                '-iso-level', '3' if largest_file > ISO_LEVEL2_MAX_FILE else '2'
+            ])
+            
             # Try xorriso first
-            if shutil.which('xorriso'):
-                cmd = [
-                    'xorriso',
-                    '-as', 'mkisofs',
-                    '-r',
-                    '-J',
-                    '-joliet-long',
-                    '-l',
-                    '-iso-level', '3',
-                    '-o', self.output_path,
-                    iso_dir
-                ]
-            elif shutil.which('genisoimage'):
-                cmd = [
-                    'genisoimage',
-                    '-r',
-                    '-J',
-                    '-joliet-long',
-                    '-l',
-                    '-iso-level', '3',
-                    '-o', self.output_path,
-                    iso_dir
-                ]
+            if self._xorriso:
+                cmd = [self._xorriso, '-as', 'mkisofs']
+            elif self._genisoimage:
+                cmd = [self._genisoimage]
             else:
                 return self._create_tar_archive(iso_dir)
+            cmd.extend(iso_opts)
+            cmd.extend(['-o', self.output_path, iso_dir])
             
             print(f"\n📀 Creating ISO file...")
-            print(f"Command: {' '.join(cmd)}")
+            if DEBUG:
+                print(f"Command: {' '.join(cmd)}")
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            returncode, stderr_tail = _run_command(cmd)
             
-            if result.returncode == 0:
-                print(f"\n✓ ISO created successfully: {self.output_path}")
-                file_size = os.path.getsize(self.output_path) / (1024 * 1024)
-                print(f"✓ Size: {file_size:.2f} MB")
-                self._report_progress(100, f"ISO created successfully ({file_size:.2f} MB)")
-                return True
+            if returncode == 0:
+                return self._report_iso_created()
             else:
                 print(f"\n❌ ISO creation failed:")
-                print(result.stderr)
+                print(stderr_tail)
                 return self._create_tar_archive(iso_dir)
                 
         except Exception as e:
             print(f"❌ Error creating ISO: {e}")
             return self._create_tar_archive(iso_dir)
     
+    def _scan_iso_tree(self, iso_dir):
+        """
+        Walk the ISO staging tree once
+        
+        Returns:
+            tuple: (length of the longest entry name, size of the largest file)
+        """
+        longest_name = 0
+        largest_file = 0
+        pending = [iso_dir]
+        while pending:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    longest_name = max(longest_name, len(entry.name))
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        largest_file = max(largest_file,
+                                           entry.stat(follow_symlinks=False).st_size)
+        return longest_name, largest_file
+    
     def _create_tar_archive(self, iso_dir):
         """Fallback: create a tar.gz archive instead of ISO"""
         try:
@@ -331,44 +1161,16 @@ menuentry "{os_name_safe} {version_safe} - Install" {{
             print(f"\n📦 Creating tar.gz archive (ISO tools not available)...")
             print(f"Output: {tar_path}")
             
-            import tarfile
-            with tarfile.open(tar_path, 'w:gz') as tar:
-                tar.add(iso_dir, arcname=os.path.basename(iso_dir))
+            file_size = self._write_tar_gz(iso_dir, tar_path) / (1024 * 1024)
             
             print(f"\n✓ Archive created successfully: {tar_path}")
-            file_size = os.path.getsize(tar_path) / (1024 * 1024)
             print(f"✓ Size: {file_size:.2f} MB")
             
             self._report_progress(95, "Creating info file...")
             # Create a text file at the ISO path explaining the situation
-            info_text = f"""Debspin ISO Builder Output
-
-The requested ISO file could not be created because required tools
-(debootstrap, xorriso, squashfs-tools) are not installed.
-
-Instead, a tar.gz archive has been created at:
-{tar_path}
-
-This archive contains all the metadata and configuration that would
-be in the ISO:
-- Boot configuration (GRUB)
-- Package lists (desktop environment + user packages)
-- ISO metadata (JSON format)
-- README with usage instructions
-
-To create a real bootable ISO, install the required tools:
-  Ubuntu/Debian: sudo apt-get install debootstrap xorriso squashfs-tools
-  Fedora: sudo dnf install debootstrap xorriso squashfs-tools
-  Arch: sudo pacman -S debootstrap libisoburn squashfs-tools
-
-Then run Debspin again to build the ISO.
-
-Archive location: {tar_path}
-ISO metadata: See debspin_metadata.json in the archive
-"""
+            info_text = _FALLBACK_INFO_TEMPLATE.format(tar_path=tar_path)
             
-            with open(self.output_path, 'w') as f:
-                f.write(info_text)
+            _write_file(self.output_path, info_text.encode('utf-8'))
             
             print(f"✓ Created info file: {self.output_path}")
             print(f"  (Contains path to tar.gz archive)")
@@ -380,58 +1182,55 @@ ISO metadata: See debspin_metadata.json in the archive
             print(f"❌ Error creating archive: {e}")
             return False
     
+    def _write_tar_gz(self, iso_dir, tar_path):
+        """
+        Write iso_dir to a gzip-compressed tarball
+        
+        The system tar is used when available, compressing through pigz
+        so all cores are used, or gzip otherwise. Python's tarfile is
+        only the last resort.
+        
+        Returns:
+            int: Size of the archive in bytes
+        """
+        arcname = os.path.basename(iso_dir)
+        tar_tool = _find_tool('tar')
+        # The archive only holds small text files; the fastest gzip
+        # level costs next to nothing in size
+        gzip_tool = self._pigz or _find_tool('gzip')
+        
+        if tar_tool and gzip_tool:
+            cmd = [
+                tar_tool,
+                f'--use-compress-program={gzip_tool} -1',
+                '-cf', tar_path,
+                '-C', os.path.dirname(iso_dir),
+                arcname
+            ]
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, text=True)
+            if result.returncode == 0:
+                return os.stat(tar_path).st_size
+            print(f"⚠ tar failed, using Python tarfile instead: {result.stderr.strip()}")
+        
+        import gzip
+        import tarfile
+        # Stream the tar through gzip into a large write buffer. GNU
+        # headers avoid PAX extended header blocks and, unlike USTAR, still
+        # store UIDs/GIDs above 2097151 (common for directory-mapped users).
+        # Counting the compressed bytes on the way out saves a stat of the
+        # finished file.
+        with open(tar_path, 'wb', buffering=TAR_BUFFER_SIZE) as raw:
+            counter = _CountingWriter(raw)
+            with gzip.GzipFile(fileobj=counter, mode='wb', compresslevel=1) as gz, \
+                    tarfile.open(fileobj=gz, mode='w|',
+                                 format=tarfile.GNU_FORMAT) as tar:
+                tar.add(iso_dir, arcname=arcname)
+        return counter.count
+    
     def _get_desktop_packages(self):
         """Get list of packages for the selected desktop manager"""
-        desktop_packages = {
-            "KDE Plasma": [
-                "kde-plasma-desktop",
-                "sddm",
-                "plasma-nm",
-                "plasma-pa"
-            ],
-            "GNOME": [
-                "gnome-core",
-                "gdm3",
-                "gnome-terminal",
-                "nautilus"
-            ],
-            "XFCE": [
-                "xfce4",
-                "xfce4-goodies",
-                "lightdm",
-                "xfce4-terminal"
-            ],
-            "LXDE": [
-                "lxde",
-                "lightdm",
-                "lxterminal"
-            ],
-            "Cinnamon": [
-                "cinnamon-desktop-environment",
-                "lightdm",
-                "gnome-terminal"
-            ],
-            "MATE": [
-                "mate-desktop-environment",
-                "lightdm",
-                "mate-terminal"
-            ],
-            "Budgie": [
-                "budgie-desktop",
-                "lightdm",
-                "gnome-terminal"
-            ],
-            "i3": [
-                "i3",
-                "lightdm",
-                "i3status",
-                "dmenu",
-                "xterm"
-            ],
-            "None (Server/Minimal)": []
-        }
-        
-        return desktop_packages.get(self.config['desktop_manager'], [])
+        return DESKTOP_PACKAGES.get(self.config['desktop_manager'], ())
     
     def _build_with_live_build(self):
         """
@@ -471,19 +1270,28 @@ ISO metadata: See debspin_metadata.json in the archive
             self._report_progress(60, "Step 3/6: Configuring live system...")
             self._configure_live_system(rootfs_dir)
             
-            # Step 4: Create squashfs filesystem
-            print("\n🗜 Step 4/6: Creating squashfs filesystem...")
-            self._report_progress(70, "Step 4/6: Creating squashfs filesystem...")
-            squashfs_path = os.path.join(squashfs_dir, 'filesystem.squashfs')
-            if not self._create_squashfs(rootfs_dir, squashfs_path):
+            # Steps 4 and 5: the boot setup only reads rootfs/boot, which
+            # mksquashfs excludes, and writes outside iso/live, so it runs
+            # on a worker thread while the filesystem is compressed
+            self._remove_build_config(rootfs_dir)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+                boot_setup = pool.submit(self._setup_boot, rootfs_dir, iso_dir,
+                                         boot_dir, grub_dir, isolinux_dir)
+                
+                print("\n🗜 Step 4/6: Creating squashfs filesystem...")
+                self._report_progress(70, "Step 4/6: Creating squashfs filesystem...")
+                squashfs_path = os.path.join(squashfs_dir, 'filesystem.squashfs')
+                squashfs_ok = self._create_squashfs(rootfs_dir, squashfs_path)
+                
+                print("\n🔧 Step 5/6: Setting up boot configuration...")
+                self._report_progress(85, "Step 5/6: Setting up boot configuration...")
+                # Re-raises anything the boot setup raised
+                boot_setup.result()
+            
+            if not squashfs_ok:
                 print("❌ Squashfs creation failed, falling back to stub ISO")
                 return self._create_stub_iso()
             
-            # Step 5: Setup boot configuration
-            print("\n🔧 Step 5/6: Setting up boot configuration...")
-            self._report_progress(85, "Step 5/6: Setting up boot configuration...")
-            self._setup_boot(rootfs_dir, iso_dir, boot_dir, grub_dir, isolinux_dir)
-            
             # Step 6: Create the final ISO
             print("\n💿 Step 6/6: Creating bootable ISO...")
             self._report_progress(90, "Step 6/6: Creating bootable ISO...")
@@ -495,21 +1303,34 @@ ISO metadata: See debspin_metadata.json in the archive
             
         except Exception as e:
             print(f"❌ Error with live-build: {e}")
-            import traceback
-            traceback.print_exc()
+            _print_trace()
             return self._create_stub_iso()
     
     def _run_debootstrap(self, rootfs_dir):
         """Bootstrap a minimal Debian system using debootstrap"""
         try:
-            # Use bookworm (Debian 12) as the stable release
-            suite = 'bookworm'
-            mirror = 'http://deb.debian.org/debian'
+            suite = DEBIAN_SUITE
+            mirror = self._pick_mirror()
+            # The chroot cannot see a file:// mirror on the host, so apt
+            # inside it uses the public mirror for the package install step
+            chroot_mirror = DEFAULT_MIRROR if mirror.startswith('file:') else mirror
+            
+            # Reuse a previously bootstrapped base system when one is cached
+            base_cache = self._base_cache_path()
+            if base_cache and self._restore_base_system(base_cache, rootfs_dir):
+                self._write_sources_list(rootfs_dir, chroot_mirror)
+                self._copy_host_resolv_conf(rootfs_dir)
+                return True
+            
+            # Keep downloaded .debs outside the work dir so rebuilds reuse them
+            cache_dir = _cache_dir('debs')
             
             cmd = [
                 'debootstrap',
-                '--variant=minbase',
-                '--include=apt,locales,sudo,systemd-sysv,live-boot,linux-image-amd64',
+                f'--variant={DEBOOTSTRAP_VARIANT}',
+                '--components=main',
+                f'--cache-dir={cache_dir}',
+                f'--include={",".join(DEBOOTSTRAP_INCLUDES)}',
                 suite,
                 rootfs_dir,
                 mirror
@@ -517,26 +1338,24 @@ ISO metadata: See debspin_metadata.json in the archive
             
             print(f"Running: {' '.join(cmd)}")
             print("This may take several minutes depending on your internet connection...")
-            print("(Downloading ~200MB of packages from Debian mirrors)")
+            print("(Downloading ~200MB of packages from Debian mirrors on the first build)")
             
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=1800  # 30 minute timeout
-            )
+            # The output goes straight to a log file, outside the work dir
+            # so it survives the cleanup for inspection after a failure
+            log_path = os.path.join(_cache_dir('logs'), 'debootstrap.log')
+            with open(log_path, 'wb') as log:
+                result = subprocess.run(
+                    cmd,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    timeout=1800  # 30 minute timeout
+                )
             
             if result.returncode != 0:
                 print(f"\n❌ Debootstrap failed!")
-                print("\nError output:")
+                print(f"\nError output (full log: {log_path}):")
                 print("-" * 40)
-                # Show both stdout and stderr for debugging (safely handle None/empty)
-                stdout = result.stdout or ''
-                stderr = result.stderr or ''
-                if stdout:
-                    print(stdout[-2000:] if len(stdout) > 2000 else stdout)
-                if stderr:
-                    print(stderr[-2000:] if len(stderr) > 2000 else stderr)
+                print(_read_tail(log_path, 2000))
                 print("-" * 40)
                 print("\nCommon causes of debootstrap failures:")
                 print("  1. No internet connection or firewall blocking access")
@@ -545,14 +1364,19 @@ ISO metadata: See debspin_metadata.json in the archive
                 print("  4. Permission issues (make sure to run with sudo)")
                 return False
             
+            if chroot_mirror != mirror:
+                self._write_sources_list(rootfs_dir, chroot_mirror)
+            
             print("✓ Base system bootstrapped successfully")
+            if base_cache:
+                self._save_base_system(rootfs_dir, base_cache)
             return True
             
         except subprocess.TimeoutExpired:
             print("❌ Debootstrap timed out after 30 minutes")
             print("\nTroubleshooting steps:")
             print("  1. Check your internet connection: ping deb.debian.org")
-            print("  2. Try a different mirror (edit iso_builder.py)")
+            print("  2. Try a different mirror (set 'mirror' in the build config)")
             print("  3. Check if download is blocked by firewall")
             print("  4. Ensure you have at least 2GB free disk space")
             return False
@@ -564,13 +1388,139 @@ ISO metadata: See debspin_metadata.json in the archive
             print(f"❌ Debootstrap error: {e}")
             return False
     
+    def _base_cache_path(self):
+        """
+        Path of the cached base system tarball for the current bootstrap
+        settings, or None when tar or zstd is not available
+        """
+        if not (_find_tool('tar') and _find_tool('zstd')):
+            return None
+        key_text = '|'.join((DEBIAN_SUITE, DEBOOTSTRAP_VARIANT,
+                             ','.join(sorted(DEBOOTSTRAP_INCLUDES))))
+        key = hashlib.sha256(key_text.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(_cache_dir('base'), f'base-{key}.tar.zst')
+    
+    def _restore_base_system(self, cache_path, rootfs_dir):
+        """
+        Unpack a cached base system into rootfs_dir
+        
+        Returns:
+            bool: True if the cache was used, False if debootstrap should run
+        """
+        try:
+            age = time.time() - os.stat(cache_path).st_mtime
+        except FileNotFoundError:
+            return False
+        if age > BASE_CACHE_MAX_AGE:
+            print("Cached base system is out of date, bootstrapping afresh")
+            return False
+        # Root unpacks this into the ISO, so only trust a root-owned cache
+        if not (_owned_by_root(cache_path)
+                and _owned_by_root(os.path.dirname(cache_path))):
+            print(f"⚠ Ignoring cached base system not owned by root: {cache_path}")
+            return False
+        
+        print(f"Restoring cached base system from {cache_path}")
+        cmd = [
+            _find_tool('tar'),
+            '--numeric-owner',
+            f"--use-compress-program={_find_tool('zstd')} -T0",
+            '-xpf', cache_path,
+            '-C', rootfs_dir
+        ]
+        try:
+            returncode, stderr_tail = _run_command(cmd, timeout=1800)
+        except subprocess.TimeoutExpired:
+            returncode, stderr_tail = -1, "timed out"
+        if returncode == 0:
+            print("✓ Base system restored from cache")
+            return True
+        
+        print(f"⚠ Could not restore cached base system: {stderr_tail.strip()}")
+        # debootstrap needs an empty target directory
+        shutil.rmtree(rootfs_dir, ignore_errors=True)
+        os.makedirs(rootfs_dir, exist_ok=True)
+        return False
+    
+    def _copy_host_resolv_conf(self, rootfs_dir):
+        """
+        Give the chroot the host's current DNS settings
+        
+        debootstrap copies /etc/resolv.conf into the target, so a cached base
+        system carries the resolver from when the cache was made.
+        """
+        target = os.path.join(rootfs_dir, 'etc', 'resolv.conf')
+        try:
+            # Unlink first: a symlink here would point into the host
+            os.unlink(target)
+        except FileNotFoundError:
+            pass
+        try:
+            _zero_copy('/etc/resolv.conf', target)
+        except OSError as e:
+            print(f"⚠ Could not copy /etc/resolv.conf into the chroot: {e}")
+    
+    def _save_base_system(self, rootfs_dir, cache_path):
+        """Store a freshly bootstrapped base system for later builds"""
+        # Write under a temporary name so a partial archive is never used
+        tmp_path = f"{cache_path}.tmp-{uuid.uuid4().hex[:8]}"
+        cmd = [
+            _find_tool('tar'),
+            '--numeric-owner',
+            f"--use-compress-program={_find_tool('zstd')} -T0 -3",
+            '-cpf', tmp_path,
+            '-C', rootfs_dir,
+            '.'
+        ]
+        try:
+            returncode, stderr_tail = _run_command(cmd, timeout=1800)
+            if returncode == 0:
+                os.replace(tmp_path, cache_path)
+                print(f"✓ Cached base system for later builds: {cache_path}")
+                return
+            print(f"⚠ Could not cache base system: {stderr_tail.strip()}")
+        except Exception as e:
+            print(f"⚠ Could not cache base system: {e}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+    
+    def _pick_mirror(self):
+        """
+        Choose the Debian mirror to bootstrap from
+        
+        An explicit 'mirror' in the config wins. Otherwise a local
+        apt-cacher-ng or apt-mirror copy is preferred over the public mirror,
+        so repeated builds are served from the local machine.
+        """
+        mirror = self.config.get('mirror')
+        if mirror:
+            return mirror
+        try:
+            with socket.create_connection(APT_CACHER_ADDRESS, timeout=0.2):
+                host, port = APT_CACHER_ADDRESS
+                print(f"Using apt-cacher-ng on {host}:{port}")
+                return f"http://{host}:{port}/deb.debian.org/debian"
+        except OSError:
+            pass
+        if os.path.isdir(os.path.join(LOCAL_MIRROR_DIR, 'dists', DEBIAN_SUITE)):
+            print(f"Using local mirror at {LOCAL_MIRROR_DIR}")
+            return f"file://{LOCAL_MIRROR_DIR}"
+        return DEFAULT_MIRROR
+    
+    def _write_sources_list(self, rootfs_dir, mirror):
+        """Point apt in the chroot at the given mirror"""
+        _write_file(os.path.join(rootfs_dir, 'etc', 'apt', 'sources.list'),
+                    f"deb {mirror} {DEBIAN_SUITE} main\n".encode('utf-8'))
+    
     def _install_packages(self, rootfs_dir):
         """Install desktop environment and user-specified packages in the chroot"""
         try:
             # Get packages for the desktop environment
             desktop_packages = self._get_desktop_packages()
             user_packages = self.config.get('packages', [])
-            all_packages = desktop_packages + user_packages
+            all_packages = list(desktop_packages) + user_packages
             
             if not all_packages:
                 print("No additional packages to install")
@@ -578,42 +1528,39 @@ ISO metadata: See debspin_metadata.json in the archive
             
             # Mount necessary filesystems for chroot
             self._mount_chroot_filesystems(rootfs_dir)
+            self._add_build_config(rootfs_dir)
+            apt_env = dict(os.environ, DEBIAN_FRONTEND='noninteractive')
             
             try:
-                # Update package lists in chroot
-                update_cmd = [
-                    'chroot', rootfs_dir,
-                    'apt-get', 'update'
-                ]
-                subprocess.run(update_cmd, capture_output=True, text=True, timeout=300)
-                
-                # Install packages
                 # Sanitize package names to prevent command injection
                 safe_packages = [self._sanitize_package_name(pkg) for pkg in all_packages]
                 safe_packages = [pkg for pkg in safe_packages if pkg]  # Remove empty strings
                 
                 if safe_packages:
+                    # Package names are passed as arguments, never spliced
+                    # into the script text
                     install_cmd = [
                         'chroot', rootfs_dir,
-                        'apt-get', 'install', '-y', '--no-install-recommends'
+                        'sh', '-c', APT_INSTALL_SCRIPT, 'sh'
                     ] + safe_packages
                     
                     print(f"Installing packages: {', '.join(safe_packages)}")
-                    result = subprocess.run(
+                    returncode, stderr_tail = _run_command(
                         install_cmd,
-                        capture_output=True,
-                        text=True,
-                        timeout=3600  # 1 hour timeout for large installs
+                        timeout=3900,  # update plus 1 hour for large installs
+                        tail_lines=20,
+                        env=apt_env
                     )
                     
-                    if result.returncode != 0:
-                        print(f"⚠ Some packages failed: {result.stderr[:500]}")
+                    if returncode != 0:
+                        print(f"⚠ Some packages failed:\n{stderr_tail}")
                     else:
                         print(f"✓ Installed {len(safe_packages)} packages")
                 
                 # Clean up apt cache to reduce size
                 clean_cmd = ['chroot', rootfs_dir, 'apt-get', 'clean']
-                subprocess.run(clean_cmd, capture_output=True)
+                subprocess.run(clean_cmd, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
                 
                 return True
                 
@@ -625,6 +1572,23 @@ ISO metadata: See debspin_metadata.json in the archive
             self._unmount_chroot_filesystems(rootfs_dir)
             return False
     
+    def _add_build_config(self, rootfs_dir):
+        """Drop the build-only dpkg/apt settings into the chroot"""
+        for rel_path, data in BUILD_ONLY_CONFIG:
+            path = os.path.join(rootfs_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _write_file(path, data)
+    
+    def _remove_build_config(self, rootfs_dir):
+        """Remove the build-only settings so the image keeps dpkg/apt defaults"""
+        for rel_path, _ in BUILD_ONLY_CONFIG:
+            try:
+                os.unlink(os.path.join(rootfs_dir, rel_path))
+            except FileNotFoundError:
+                pass
+        # The image should not depend on a cache or mirror on the build host
+        self._write_sources_list(rootfs_dir, DEFAULT_MIRROR)
+    
     def _sanitize_package_name(self, package_name):
         """
         Sanitize package name to prevent command injection
@@ -633,7 +1597,7 @@ ISO metadata: See debspin_metadata.json in the archive
         if not package_name:
             return ''
         # Only allow valid package name characters
-        sanitized = re.sub(r'[^a-z0-9+.\-]', '', package_name.lower())
+        sanitized = _PKG_BAD_RE.sub('', package_name.lower())
         # Package names must start with alphanumeric
         if sanitized and not sanitized[0].isalnum():
             return ''
@@ -644,7 +1608,7 @@ ISO metadata: See debspin_metadata.json in the archive
         mounts = [
             ('proc', os.path.join(rootfs_dir, 'proc'), 'proc'),
             ('sysfs', os.path.join(rootfs_dir, 'sys'), 'sysfs'),
-            ('/dev', os.path.join(rootfs_dir, 'dev'), None),  # bind mount
+            ('/dev', os.path.join(rootfs_dir, 'dev'), None),  # recursive bind mount
         ]
         
         mounted = []
@@ -653,10 +1617,14 @@ ISO metadata: See debspin_metadata.json in the archive
             try:
                 if fstype:
                     result = subprocess.run(['mount', '-t', fstype, source, target], 
-                                 capture_output=True, text=True, check=False)
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                 text=True, check=False)
                 else:
-                    result = subprocess.run(['mount', '--bind', source, target],
-                                 capture_output=True, text=True, check=False)
+                    # Take /dev/pts and /dev/shm along, and keep unmounts
+                    # inside the chroot from propagating back to the host
+                    result = subprocess.run(['mount', '--rbind', '--make-rslave', source, target],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                 text=True, check=False)
                 
                 if result.returncode == 0:
                     mounted.append(target)
@@ -675,67 +1643,74 @@ ISO metadata: See debspin_metadata.json in the archive
         for subdir in ['dev', 'sys', 'proc']:
             target = os.path.join(rootfs_dir, subdir)
             try:
-                subprocess.run(['umount', '-l', target], capture_output=True, check=False)
+                # -R also takes down the submounts of the /dev rbind
+                subprocess.run(['umount', '-R', '-l', target], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL, check=False)
             except Exception:
                 pass  # Best effort unmount
     
     def _configure_live_system(self, rootfs_dir):
         """Configure the rootfs for live boot"""
         try:
-            # Create a default user for live session
-            user_cmds = [
-                ['chroot', rootfs_dir, 'useradd', '-m', '-s', '/bin/bash', 'user'],
-                ['chroot', rootfs_dir, 'usermod', '-aG', 'sudo', 'user'],
-            ]
-            
-            for cmd in user_cmds:
-                subprocess.run(cmd, capture_output=True, check=False)
+            # Create a default user for live session, already in the sudo group
+            useradd_cmd = ['chroot', rootfs_dir, 'useradd', '-m', '-s', '/bin/bash',
+                           '-G', 'sudo', 'user']
+            subprocess.run(useradd_cmd, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=False)
             
             # Set default password 'live' for the live user
             # This is more secure than an empty password while still being convenient
             # Using chpasswd to set the password
             passwd_cmd = ['chroot', rootfs_dir, 'chpasswd']
-            subprocess.run(passwd_cmd, input='user:live\n', capture_output=True, 
-                          text=True, check=False)
+            subprocess.run(passwd_cmd, input='user:live\n', stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL, text=True, check=False)
             
             # Configure passwordless sudo for live user (common for live systems)
             sudoers_dir = os.path.join(rootfs_dir, 'etc', 'sudoers.d')
             os.makedirs(sudoers_dir, exist_ok=True)
             sudoers_file = os.path.join(sudoers_dir, 'live-user')
-            with open(sudoers_file, 'w') as f:
-                f.write('user ALL=(ALL) NOPASSWD: ALL\n')
-            os.chmod(sudoers_file, 0o440)
+            _write_file(sudoers_file, b'user ALL=(ALL) NOPASSWD: ALL\n', mode=0o440)
             
             # Configure hostname with sanitized value
             hostname = sanitize_filename(self.config['os_name']).lower()[:63]
             if not hostname:
                 hostname = 'debspin-live'
             hostname_path = os.path.join(rootfs_dir, 'etc', 'hostname')
-            with open(hostname_path, 'w') as f:
-                f.write(f"{hostname}\n")
+            _write_file(hostname_path, f"{hostname}\n".encode('utf-8'))
             
             # Configure hosts file
             hosts_path = os.path.join(rootfs_dir, 'etc', 'hosts')
-            with open(hosts_path, 'w') as f:
-                f.write("127.0.0.1\tlocalhost\n")
-                f.write(f"127.0.1.1\t{hostname}\n")
+            _write_file(hosts_path, ("127.0.0.1\tlocalhost\n"
+                                     f"127.0.1.1\t{hostname}\n").encode('utf-8'))
             
             # Create os-release file
             os_release_path = os.path.join(rootfs_dir, 'etc', 'os-release')
             os_name_safe = sanitize_grub_string(self.config['os_name'])
             version_safe = sanitize_grub_string(self.config['version_code'])
-            with open(os_release_path, 'w') as f:
-                f.write(f'PRETTY_NAME="{os_name_safe} {version_safe}"\n')
-                f.write(f'NAME="{os_name_safe}"\n')
-                f.write(f'VERSION="{version_safe}"\n')
-                f.write(f'ID={sanitize_filename(self.config["os_name"]).lower()}\n')
-                f.write('ID_LIKE=debian\n')
+            os_release = (f'PRETTY_NAME="{os_name_safe} {version_safe}"\n'
+                          f'NAME="{os_name_safe}"\n'
+                          f'VERSION="{version_safe}"\n'
+                          f'ID={sanitize_filename(self.config["os_name"]).lower()}\n'
+                          'ID_LIKE=debian\n')
+            _write_file(os_release_path, os_release.encode('utf-8'))
             
             print("✓ Live system configured")
             
         except Exception as e:
             print(f"⚠ Configuration warning: {e}")
     
+    def _rootfs_size(self, rootfs_dir):
+        """
+        Estimate the rootfs size in bytes without statting every file
+        
+        On the dedicated tmpfs the used space is the rootfs, so one statvfs
+        is enough; otherwise a single du call does the walk.
+        """
+        if self._tmpfs_mounted:
+            st = os.statvfs(self.work_dir)
+            return (st.f_blocks - st.f_bfree) * st.f_frsize
+        return _du_size(rootfs_dir)
+    
     def _create_squashfs(self, rootfs_dir, output_path):
         """Create squashfs filesystem from rootfs"""
         try:
@@ -743,24 +1718,34 @@ ISO metadata: See debspin_metadata.json in the archive
                 'mksquashfs',
                 rootfs_dir,
                 output_path,
-                '-comp', 'xz',
-                '-e', 'boot'  # Exclude /boot, we'll handle it separately
+                *self._squashfs_comp_args(),
+                '-processors', str(os.cpu_count() or 1),
+                '-b', '1M',
+                # Newer mksquashfs can print a bare percentage per line,
+                # which drives the progress bar; otherwise stay quiet
+                '-percentage' if _mksquashfs_has_option('-percentage') else '-no-progress',
+                '-wildcards',
+                # Exclude /boot, we'll handle it separately. The contents of
+                # the virtual and scratch filesystems are not needed either;
+                # the empty directories stay as mount points.
+                '-e', 'boot', 'proc/*', 'sys/*', 'tmp/*'
             ]
             
+            # Allow 10 minutes per GiB of input, and at least an hour
+            size_gib = self._rootfs_size(rootfs_dir) / (1024 * 1024 * 1024)
+            timeout = max(3600, int(size_gib * 600))
+            
             print("Creating compressed filesystem (this may take a while)...")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=3600  # 1 hour timeout
+            returncode, stderr_tail = _run_command(
+                cmd, timeout=timeout, on_line=self._squashfs_progress_reporter()
             )
             
-            if result.returncode != 0:
-                print(f"Squashfs error: {result.stderr}")
+            if returncode != 0:
+                print(f"Squashfs error: {stderr_tail}")
                 return False
             
             # Get size
-            size_mb = os.path.getsize(output_path) / (1024 * 1024)
+            size_mb = os.stat(output_path).st_size / (1024 * 1024)
             print(f"✓ Squashfs created: {size_mb:.1f} MB")
             return True
             
@@ -771,99 +1756,103 @@ ISO metadata: See debspin_metadata.json in the archive
             print(f"❌ Squashfs error: {e}")
             return False
     
+    def _squashfs_comp_args(self):
+        """
+        Return the mksquashfs compression options
+        
+        config['squashfs_comp'] picks the compressor (default 'zstd'). zstd
+        runs at level 19 with 8 or more CPUs and at 15 below that, where 19
+        would take too long. xz gets the x86 branch filter, which shrinks
+        executables noticeably. A compressor mksquashfs was built without
+        falls back to xz.
+        """
+        requested = self.config.get('squashfs_comp')
+        comp = requested or 'zstd'
+        if comp != 'xz' and not _mksquashfs_has_compressor(comp):
+            if requested:
+                print(f"⚠ mksquashfs does not support {comp}, using xz")
+            comp = 'xz'
+        
+        if comp == 'zstd':
+            level = '19' if (os.cpu_count() or 1) >= 8 else '15'
+            return ['-comp', 'zstd', '-Xcompression-level', level]
+        if comp == 'xz':
+            return ['-comp', 'xz', '-Xbcj', 'x86']
+        return ['-comp', comp]
+    
+    def _squashfs_progress_reporter(self):
+        """
+        Return a callback mapping mksquashfs -percentage lines onto the
+        squashfs step's share of the progress bar (70-84%)
+        """
+        last = None
+        
+        def on_line(line):
+            nonlocal last
+            try:
+                percent = int(line)
+            except ValueError:
+                return
+            overall = 70 + min(max(percent, 0), 100) * 14 // 100
+            # Only report changes, not every line mksquashfs prints
+            if overall != last:
+                last = overall
+                self._report_progress(overall, f"Step 4/6: Compressing filesystem ({percent}%)")
+        
+        return on_line
+    
     def _setup_boot(self, rootfs_dir, iso_dir, boot_dir, grub_dir, isolinux_dir):
         """Setup boot configuration for the ISO"""
         os_name_safe = sanitize_grub_string(self.config['os_name'])
         version_safe = sanitize_grub_string(self.config['version_code'])
         
-        # Copy kernel and initrd from rootfs to ISO boot directory
+        # Link (or copy) kernel and initrd from rootfs to ISO boot directory
         kernel_src = os.path.join(rootfs_dir, 'boot')
         if os.path.exists(kernel_src):
-            for f in os.listdir(kernel_src):
-                src = os.path.join(kernel_src, f)
-                if os.path.isfile(src):
-                    if f.startswith('vmlinuz'):
-                        shutil.copy2(src, os.path.join(boot_dir, 'vmlinuz'))
-                    elif f.startswith('initrd') or f.startswith('initramfs'):
-                        shutil.copy2(src, os.path.join(boot_dir, 'initrd.img'))
+            # DirEntry types come from the directory listing itself, so
+            # only the files actually staged are stat'ed
+            with os.scandir(kernel_src) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        if entry.name.startswith('vmlinuz'):
+                            _link_or_copy(entry.path, os.path.join(boot_dir, 'vmlinuz'))
+                        elif entry.name.startswith(('initrd', 'initramfs')):
+                            _link_or_copy(entry.path, os.path.join(boot_dir, 'initrd.img'))
+        
+        fields = {'os_name': os_name_safe, 'version': version_safe}
         
         # Create GRUB configuration for EFI boot
         grub_cfg = os.path.join(grub_dir, 'grub.cfg')
-        with open(grub_cfg, 'w') as f:
-            f.write(f'''# GRUB Configuration for {os_name_safe}
-set default=0
-set timeout=10
-
-insmod all_video
-insmod gfxterm
-
-menuentry "{os_name_safe} {version_safe} - Live (Try without installing)" {{
-    linux /boot/vmlinuz boot=live quiet splash
-    initrd /boot/initrd.img
-}}
-
-menuentry "{os_name_safe} {version_safe} - Live (Safe graphics)" {{
-    linux /boot/vmlinuz boot=live nomodeset quiet
-    initrd /boot/initrd.img
-}}
-
-menuentry "{os_name_safe} {version_safe} - Install" {{
-    linux /boot/vmlinuz boot=live quiet
-    initrd /boot/initrd.img
-}}
-
-menuentry "Boot from first hard disk" {{
-    set root=(hd0)
-    chainloader +1
-}}
-''')
+        grub_entries = "".join(
+            _GRUB_MENUENTRY.format(title=title, args=args, **fields)
+            for _, title, _, args in LIVE_BOOT_ENTRIES
+        )
+        _write_file(grub_cfg, [
+            _LIVE_GRUB_HEADER.format_map(fields).encode('utf-8'),
+            grub_entries.encode('utf-8'),
+            _LIVE_GRUB_FOOTER,
+        ])
         
         # Create isolinux configuration for BIOS boot
         isolinux_cfg = os.path.join(isolinux_dir, 'isolinux.cfg')
         # Only create if isolinux.bin exists on the system
-        isolinux_bin_paths = [
-            '/usr/lib/ISOLINUX/isolinux.bin',
-            '/usr/share/syslinux/isolinux.bin',
-            '/usr/lib/syslinux/isolinux.bin'
-        ]
-        
-        for path in isolinux_bin_paths:
-            if os.path.exists(path):
-                shutil.copy2(path, os.path.join(isolinux_dir, 'isolinux.bin'))
-                break
+        isolinux_bin = _find_first_existing(ISOLINUX_BIN_PATHS)
+        if isolinux_bin:
+            _zero_copy(isolinux_bin, os.path.join(isolinux_dir, 'isolinux.bin'))
         
         # Copy ldlinux.c32 if it exists
-        ldlinux_paths = [
-            '/usr/lib/syslinux/modules/bios/ldlinux.c32',
-            '/usr/share/syslinux/ldlinux.c32',
-            '/usr/lib/ISOLINUX/ldlinux.c32'
-        ]
-        for path in ldlinux_paths:
-            if os.path.exists(path):
-                shutil.copy2(path, os.path.join(isolinux_dir, 'ldlinux.c32'))
-                break
+        ldlinux_c32 = _find_first_existing(LDLINUX_C32_PATHS)
+        if ldlinux_c32:
+            _zero_copy(ldlinux_c32, os.path.join(isolinux_dir, 'ldlinux.c32'))
         
-        with open(isolinux_cfg, 'w') as f:
-            f.write(f'''# ISOLINUX Configuration for {os_name_safe}
-DEFAULT live
-TIMEOUT 100
-PROMPT 1
-
-LABEL live
-    MENU LABEL {os_name_safe} {version_safe} - Live
-    KERNEL /boot/vmlinuz
-    APPEND initrd=/boot/initrd.img boot=live quiet splash
-
-LABEL livesafe
-    MENU LABEL {os_name_safe} {version_safe} - Live (Safe graphics)
-    KERNEL /boot/vmlinuz
-    APPEND initrd=/boot/initrd.img boot=live nomodeset quiet
-
-LABEL install
-    MENU LABEL {os_name_safe} {version_safe} - Install
-    KERNEL /boot/vmlinuz
-    APPEND initrd=/boot/initrd.img boot=live quiet
-''')
+        isolinux_labels = "\n".join(
+            _ISOLINUX_LABEL.format(label=label, title=title, args=args, **fields)
+            for label, _, title, args in LIVE_BOOT_ENTRIES
+        )
+        _write_file(isolinux_cfg, [
+            _ISOLINUX_HEADER.format_map(fields).encode('utf-8'),
+            isolinux_labels.encode('utf-8'),
+        ])
         
         # Create metadata file
         metadata = {
@@ -879,27 +1868,34 @@ LABEL install
         }
         metadata_path = os.path.join(iso_dir, '.disk', 'info')
         os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
-        with open(metadata_path, 'w') as f:
-            f.write(f"{os_name_safe} {version_safe}")
+        _write_file(metadata_path, f"{os_name_safe} {version_safe}".encode('utf-8'))
         
         metadata_json_path = os.path.join(iso_dir, 'debspin_metadata.json')
-        with open(metadata_json_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        _write_file(metadata_json_path, encode_json(metadata, compact=True))
         
         print("✓ Boot configuration created")
     
     def _create_bootable_iso(self, iso_dir):
         """Create the final bootable ISO using xorriso"""
+        # xorriso writes next to the output and the result is renamed into
+        # place, so a failed run leaves any previous ISO untouched
+        tmp_path = f"{self.output_path}.part-{uuid.uuid4().hex[:8]}"
         try:
-            # Remove existing output file if it exists (xorriso may fail to overwrite)
-            if os.path.exists(self.output_path):
-                try:
-                    os.remove(self.output_path)
-                except Exception:
-                    pass  # Ignore removal errors
+            # Add BIOS boot if isolinux.bin exists
+            isolinux_bin = os.path.join(iso_dir, 'isolinux', 'isolinux.bin')
+            if os.path.exists(isolinux_bin):
+                bios_opts = (
+                    '-b', 'isolinux/isolinux.bin',
+                    '-c', 'isolinux/boot.cat',
+                    '-no-emul-boot',
+                    '-boot-load-size', '4',
+                    '-boot-info-table',
+                )
+            else:
+                bios_opts = ()
             
             # Build xorriso command for bootable ISO
-            cmd = [
+            cmd = (
                 'xorriso',
                 '-as', 'mkisofs',
                 '-r',                           # Rock Ridge extensions
@@ -908,46 +1904,33 @@ LABEL install
                 '-l',                           # Allow full 31-char filenames
                 '-iso-level', '3',              # ISO level 3 for large files
                 '-V', sanitize_filename(self.config['os_name'])[:32],  # Volume label
-            ]
-            
-            # Add BIOS boot if isolinux.bin exists
-            isolinux_bin = os.path.join(iso_dir, 'isolinux', 'isolinux.bin')
-            if os.path.exists(isolinux_bin):
-                cmd.extend([
-                    '-b', 'isolinux/isolinux.bin',
-                    '-c', 'isolinux/boot.cat',
-                    '-no-emul-boot',
-                    '-boot-load-size', '4',
-                    '-boot-info-table',
-                ])
-            
-            cmd.extend([
-                '-o', self.output_path,
+                *bios_opts,
+                '-o', tmp_path,
                 iso_dir
-            ])
+            )
             
             print(f"Creating ISO: {self.output_path}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=1800
-            )
+            returncode, stderr_tail = _run_command(cmd, timeout=1800)
             
             # Check if the file was created successfully, even if xorriso reports warnings
-            if os.path.exists(self.output_path):
-                file_size = os.path.getsize(self.output_path)
-                # If file size is reasonable (> 1MB), consider it a success
-                if file_size > 1024 * 1024:
-                    file_size_mb = file_size / (1024 * 1024)
-                    print(f"\n✓ ISO created successfully: {self.output_path}")
-                    print(f"✓ Size: {file_size_mb:.1f} MB")
-                    self._report_progress(100, f"ISO created successfully ({file_size_mb:.1f} MB)")
-                    return True
+            try:
+                file_size = os.stat(tmp_path).st_size
+            except FileNotFoundError:
+                file_size = 0
+            # If file size is reasonable (> 1MB), consider it a success
+            if file_size > 1024 * 1024:
+                os.replace(tmp_path, self.output_path)
+                # The ISO is not read again by this build, so free the RAM
+                _drop_page_cache(self.output_path)
+                file_size_mb = file_size / (1024 * 1024)
+                print(f"\n✓ ISO created successfully: {self.output_path}")
+                print(f"✓ Size: {file_size_mb:.1f} MB")
+                self._report_progress(100, f"ISO created successfully ({file_size_mb:.1f} MB)")
+                return True
             
             # If we reach here, the ISO was not created properly
-            if result.returncode != 0:
-                print(f"ISO creation error: {result.stderr}")
+            if returncode != 0:
+                print(f"ISO creation error: {stderr_tail}")
             return False
             
         except subprocess.TimeoutExpired:
@@ -956,6 +1939,11 @@ LABEL install
         except Exception as e:
             print(f"❌ ISO creation error: {e}")
             return False
+        finally:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
 
 
 if __name__ == "__main__":
@@ -57,6 +57,129 @@ def test_config_generation():
     print("\n✅ All tests passed!")
     return True
 
+def test_encode_json_matches_stdlib():
+    """Test that the JSON encoder matches the stdlib indented layout"""
+    print("Testing JSON encoding...")
+    
+    from iso_builder import encode_json
+    
+    config = {
+        "os_name": "TestDebian",
+        "version_code": "1.0",
+        "desktop_manager": "KDE Plasma",
+        "packages": ["firefox-esr", "libreoffice", "git"],
+        "created_at": "2026-01-21T18:13:41.000000",
+        "version": "1.0"
+    }
+    
+    expected = json.dumps(config, indent=2)
+    assert encode_json(config).decode('utf-8') == expected, \
+        "encode_json output should match json.dumps(indent=2)"
+    
+    expected_compact = json.dumps(config, separators=(',', ':'))
+    assert encode_json(config, compact=True).decode('utf-8') == expected_compact, \
+        "encode_json(compact=True) should match json.dumps with compact separators"
+    print("✓ encode_json output matches json.dumps")
+    return True
+
+# Trimmed mksquashfs help output. 4.5 lists every option under -help and
+# rejects -help-all; 4.6 prints a section summary for -help and the options
+# under -help-all.
+MKSQUASHFS_45_HELP = """\
+SYNTAX:mksquashfs source1 source2 ...  FILESYSTEM [OPTIONS] [-e list of exclude
+dirs/files]
+
+Filesystem build options:
+-comp <comp>\t\tselect <comp> compression
+\t\t\tCompressors available:
+\t\t\t\tgzip (default)
+\t\t\t\txz
+\t\t\t\tzstd
+-b <block_size>\t\tset data block to <block_size>.  Default 128 Kbytes
+
+Mksquashfs runtime options:
+-processors <number>\tUse <number> processors.  By default will use number of
+\t\t\tprocessors available
+-no-progress\t\tdon't display the progress bar
+-progress\t\tdisplay progress bar when using the -info option
+"""
+
+MKSQUASHFS_46_HELP = """\
+SYNTAX:mksquashfs source1 source2 ...  FILESYSTEM [OPTIONS] [-e list of
+exclude dirs/files]
+
+Run
+  "mksquashfs -help-option <regex>" to get help on all options matching <regex>
+  "mksquashfs -help-section <section-name>" to get help on these sections
+\tSECTION NAME\t\tSECTION
+\tcompression\t\tFilesystem compression options:
+\truntime\t\t\tMksquashfs runtime options:
+  "mksquashfs -help-all" to get help on all the sections
+"""
+
+MKSQUASHFS_46_HELP_ALL = """\
+SYNTAX:mksquashfs source1 source2 ...  FILESYSTEM [OPTIONS] [-e list of
+exclude dirs/files]
+
+Filesystem compression options:
+-b <block-size>\t\tset data block to <block-size>.  Default 128 Kbytes.
+-comp <comp>\t\tselect <comp> compression.  Run -help-comp <comp> to get
+\t\t\tcompressor options for <comp>, or <all> for all the
+\t\t\tcompressors.
+
+Mksquashfs runtime options:
+-processors <number>\tuse <number> processors.  By default will use number of
+\t\t\tprocessors available
+-no-progress\t\tdo not display the progress bar
+-percentage\t\tdisplay a percentage rather than the full progress bar.
+
+Compressors available and compressor specific options:
+\tgzip (default)
+\txz
+\tzstd
+"""
+
+def test_mksquashfs_help_probe():
+    """Test option and compressor detection against 4.5 and 4.6 help text"""
+    print("Testing mksquashfs help probing...")
+    
+    import subprocess
+    from unittest import mock
+    import iso_builder
+    
+    def fake_run(outputs):
+        def run(cmd, **kwargs):
+            stdout, returncode = outputs[cmd[1]]
+            return subprocess.CompletedProcess(cmd, returncode, stdout, '')
+        return run
+    
+    versions = {
+        '4.5': {'-help-all': ("mksquashfs: invalid option\n", 1),
+                '-help': (MKSQUASHFS_45_HELP, 0)},
+        '4.6': {'-help-all': (MKSQUASHFS_46_HELP_ALL, 0),
+                '-help': (MKSQUASHFS_46_HELP, 0)},
+    }
+    expected_percentage = {'4.5': False, '4.6': True}
+    
+    try:
+        for version, outputs in versions.items():
+            iso_builder._mksquashfs_help.cache_clear()
+            with mock.patch.object(iso_builder.subprocess, 'run', fake_run(outputs)):
+                assert iso_builder._mksquashfs_has_option('-percentage') == \
+                    expected_percentage[version], f"-percentage detection for {version}"
+                assert iso_builder._mksquashfs_has_option('-no-progress'), \
+                    f"-no-progress should be found for {version}"
+                assert iso_builder._mksquashfs_has_compressor('zstd'), \
+                    f"zstd should be found for {version}"
+                assert not iso_builder._mksquashfs_has_compressor('lz4'), \
+                    f"lz4 should not be found for {version}"
+    finally:
+        iso_builder._mksquashfs_help.cache_clear()
+    
+    print("✓ mksquashfs options and compressors detected for 4.5 and 4.6")
+    return True
+
 if __name__ == "__main__":
-    success = test_config_generation()
+    success = (test_config_generation() and test_encode_json_matches_stdlib()
+               and test_mksquashfs_help_probe())
     sys.exit(0 if success else 1)
@@ -4,15 +4,18 @@ Integration test for Debspin GUI and ISO Builder
 Tests the complete workflow without requiring tkinter
 """
 
+import contextlib
+import io
 import json
 import sys
 import os
+import subprocess
 import tempfile
 
 # Add the directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from iso_builder import ISOBuilder, sanitize_filename
+from iso_builder import ISOBuilder, sanitize_filename, sanitize_grub_string, pycdlib
 
 def test_iso_creation():
     """Test ISO creation with various configurations"""
@@ -126,6 +129,156 @@ def test_config_with_version_code():
         print()
         return False
 
+def test_sanitizers():
+    """Test filename and GRUB string sanitization"""
+    print("Testing sanitizers...\n")
+    
+    filename_cases = [
+        ("My Debian Spin", "My_Debian_Spin"),
+        ('a/b\\c:d*e?f"g<h>i|j', "abcdefghij"),
+        ("..-Hello World!-..", "Hello_World"),
+        ("Tëst Ünïcode", "T-st_-n-code"),
+        ("tab\there", "tab-here"),
+        ("ok-1.0_rc", "ok-1.0_rc"),
+    ]
+    for text, expected in filename_cases:
+        result = sanitize_filename(text)
+        assert result == expected, \
+            f"sanitize_filename({text!r}) returned {result!r}, expected {expected!r}"
+    print("✓ sanitize_filename produces safe names")
+    
+    grub_cases = [
+        ('Say "hi"', 'Say \\"hi\\"'),
+        ("back\\slash", "back\\\\slash"),
+        ("ctrl\x01\x1f\x7fend", "ctrlend"),
+        ("new\nline", "newline"),
+        ("plain 1.0", "plain 1.0"),
+    ]
+    for text, expected in grub_cases:
+        result = sanitize_grub_string(text)
+        assert result == expected, \
+            f"sanitize_grub_string({text!r}) returned {result!r}, expected {expected!r}"
+    print("✓ sanitize_grub_string escapes quotes and strips control characters")
+    
+    print()
+    return True
+
+def test_setup_boot():
+    """Test that the live boot setup stages the kernel, initrd and menus"""
+    print("Testing live boot setup...\n")
+    
+    config = {
+        "os_name": "TestBoot",
+        "version_code": "1.0",
+        "desktop_manager": "XFCE",
+        "packages": ["vim"],
+        "created_at": "2026-01-21T18:00:00"
+    }
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rootfs_dir = os.path.join(tmpdir, 'rootfs')
+        iso_dir = os.path.join(tmpdir, 'iso')
+        boot_dir = os.path.join(iso_dir, 'boot')
+        grub_dir = os.path.join(boot_dir, 'grub')
+        isolinux_dir = os.path.join(iso_dir, 'isolinux')
+        for d in [os.path.join(rootfs_dir, 'boot'), grub_dir, isolinux_dir]:
+            os.makedirs(d)
+        
+        kernel = b"kernel image"
+        initrd = b"initial ramdisk"
+        with open(os.path.join(rootfs_dir, 'boot', 'vmlinuz-6.1.0-amd64'), 'wb') as f:
+            f.write(kernel)
+        with open(os.path.join(rootfs_dir, 'boot', 'initrd.img-6.1.0-amd64'), 'wb') as f:
+            f.write(initrd)
+        
+        builder = ISOBuilder(config, os.path.join(tmpdir, 'out.iso'))
+        builder._setup_boot(rootfs_dir, iso_dir, boot_dir, grub_dir, isolinux_dir)
+        
+        with open(os.path.join(boot_dir, 'vmlinuz'), 'rb') as f:
+            assert f.read() == kernel, "Kernel should be staged as boot/vmlinuz"
+        with open(os.path.join(boot_dir, 'initrd.img'), 'rb') as f:
+            assert f.read() == initrd, "Initrd should be staged as boot/initrd.img"
+        with open(os.path.join(grub_dir, 'grub.cfg')) as f:
+            assert 'menuentry "TestBoot 1.0 - Install"' in f.read()
+        with open(os.path.join(isolinux_dir, 'isolinux.cfg')) as f:
+            assert 'MENU LABEL TestBoot 1.0 - Live' in f.read()
+    
+    print("✓ Kernel, initrd and boot menus staged")
+    print()
+    return True
+
+def test_long_volume_name():
+    """Test that a long OS name still produces an ISO with pycdlib"""
+    print("Testing ISO creation with a long OS name...\n")
+    
+    if pycdlib is None:
+        print("⚠ pycdlib not installed, skipping")
+        print()
+        return True
+    
+    config = {
+        "os_name": "Debian Custom Edition",
+        "version_code": "1.0",
+        "desktop_manager": "XFCE",
+        "packages": ["vim"],
+        "created_at": "2026-01-21T18:00:00"
+    }
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        iso_dir = os.path.join(tmpdir, 'iso')
+        os.makedirs(iso_dir)
+        with open(os.path.join(iso_dir, 'README.txt'), 'w') as f:
+            f.write("stub")
+        
+        builder = ISOBuilder(config, os.path.join(tmpdir, 'out.iso'))
+        # A pycdlib failure falls back to xorriso, so check the output too
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            builder._create_iso_with_pycdlib(iso_dir)
+        assert "pycdlib could not" not in output.getvalue(), output.getvalue()
+        
+        with open(os.path.join(tmpdir, 'out.iso'), 'rb') as f:
+            f.seek(0x8001)
+            assert f.read(5) == b'CD001', "Output should be an ISO9660 image"
+    
+    print("✓ ISO created for a name longer than the Joliet volume ID")
+    print()
+    return True
+
+def test_work_dir_removed_at_exit():
+    """Test that a build's working directory is gone once the process exits"""
+    print("Testing working directory cleanup at exit...\n")
+    
+    script = (
+        "import sys\n"
+        "from iso_builder import ISOBuilder\n"
+        "config = {'os_name': 'TestCleanup', 'version_code': '1.0',\n"
+        "          'desktop_manager': 'XFCE', 'packages': ['vim'],\n"
+        "          'created_at': '2026-01-21T18:00:00'}\n"
+        "ISOBuilder(config, sys.argv[1]).build()\n"
+    )
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # The stub build creates its work dir in the system temp dir
+        work_parent = os.path.join(tmpdir, 'work')
+        os.makedirs(work_parent)
+        result = subprocess.run(
+            [sys.executable, '-c', script, os.path.join(tmpdir, 'out.iso')],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(os.environ, TMPDIR=work_parent),
+            capture_output=True, text=True, timeout=300
+        )
+        assert result.returncode == 0, result.stderr
+        assert "Could not clean up" not in result.stdout, result.stdout
+        
+        leftovers = [name for name in os.listdir(tmpdir) if name != 'out.iso']
+        leftovers += os.listdir(work_parent)
+        assert leftovers == ['work'], f"Working directory left behind: {leftovers}"
+    
+    print("✓ Working directory removed before exit")
+    print()
+    return True
+
 if __name__ == "__main__":
     print("="*60)
     print("Debspin Integration Tests")
@@ -133,9 +286,13 @@ if __name__ == "__main__":
     print()
     
     test1 = test_config_with_version_code()
-    test2 = test_iso_creation()
+    test2 = test_sanitizers()
+    test3 = test_setup_boot()
+    test4 = test_iso_creation()
+    test5 = test_long_volume_name()
+    test6 = test_work_dir_removed_at_exit()
     
-    if test1 and test2:
+    if test1 and test2 and test3 and test4 and test5 and test6:
         print("\n✅ All tests passed successfully!")
         sys.exit(0)
     else: